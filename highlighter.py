@@ -2,67 +2,96 @@
 Highlighter module to create HTML reports highlighting plagiarized segments.
 """
 
+from operator import itemgetter
+
+_start_key = itemgetter('suspicious_start_char')
+
+# Minimal HTML template with inline CSS for highlighting
+_REPORT_HEADER = (
+    "<html><head><title>Plagiarism Report</title>"
+    "<style>body{font-family:Arial,sans-serif;margin:20px}"
+    ".highlight{background-color:yellow}"
+    "table{border-collapse:collapse}td,th{padding:2px 8px;text-align:left}</style>"
+    "</head><body><h1>Plagiarism Detection Report</h1>"
+)
+
+_REPORT_FOOTER = "</body></html>\n"
+
+# Above this many sources the summary is a table rather than a bullet list
+_SOURCE_TABLE_THRESHOLD = 100
+
 def create_html_report(suspicious_text, detected_segments, source_matches=None, output_file="plagiarism_report.html"):
     """
     Create an HTML report highlighting plagiarized segments in the suspicious text.
 
+    The report is streamed to the output file piece by piece rather than
+    built up in memory first.
+
     Args:
         suspicious_text (str): The suspicious document text.
-        detected_segments (list): List of detected plagiarized segments with start and end character indices.
+        detected_segments (list): List of detected plagiarized segments with start and end character indices (sorted in place).
         source_matches (dict, optional): Dictionary of source matches with similarity info.
-        output_file (str): Path to output HTML file.
+        output_file (str or file-like): Path to output HTML file, or an open text file to write to.
 
     Returns:
-        str: Path to the created HTML report.
+        str or file-like: The output_file the report was written to.
     """
-    # Basic HTML template with inline CSS for highlighting
-    html_content = """
-    <html>
-    <head>
-        <title>Plagiarism Report</title>
-        <style>
-            body { font-family: Arial, sans-serif; margin: 20px; }
-            .highlight { background-color: yellow; }
-            .segment { margin-bottom: 10px; padding: 5px; border: 1px solid #ccc; }
-            .source-info { font-size: 0.9em; color: #555; }
-        </style>
-    </head>
-    <body>
-        <h1>Plagiarism Detection Report</h1>
+    chunks = iter_html_report(suspicious_text, detected_segments, source_matches)
+    if hasattr(output_file, 'write'):
+        output_file.writelines(chunks)
+    else:
+        with open(output_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            f.writelines(chunks)
+
+    return output_file
+
+def iter_html_report(suspicious_text, detected_segments, source_matches=None):
     """
+    Generate the HTML report chunk by chunk, e.g. to stream it as a response.
+
+    Args:
+        suspicious_text (str): The suspicious document text.
+        detected_segments (list): List of detected plagiarized segments with start and end character indices (sorted in place).
+        source_matches (dict, optional): Dictionary of source matches with similarity info.
+
+    Yields:
+        str: Consecutive pieces of the report.
+    """
+    yield _REPORT_HEADER
 
     # Highlight plagiarized segments in the suspicious text
+    yield "<p>"
     last_index = 0
-    highlighted_text = ""
-    for segment in sorted(detected_segments, key=lambda s: s['suspicious_start_char']):
+    detected_segments.sort(key=_start_key)
+    for segment in detected_segments:
         start = segment['suspicious_start_char']
         end = segment['suspicious_end_char']
-        # Append text before the segment
-        highlighted_text += suspicious_text[last_index:start]
-        # Append highlighted segment
-        highlighted_text += f"<span class='highlight'>{suspicious_text[start:end]}</span>"
+        # Text before the segment, then the highlighted segment
+        yield suspicious_text[last_index:start]
+        yield f"<span class='highlight'>{suspicious_text[start:end]}</span>"
         last_index = end
-    # Append remaining text
-    highlighted_text += suspicious_text[last_index:]
-
-    html_content += f"<p>{highlighted_text}</p>"
+    # Remaining text
+    yield suspicious_text[last_index:]
+    yield "</p>"
 
     # Add source matches summary if available
     if source_matches:
-        html_content += "<h2>Source Matches</h2><ul>"
-        for source_name, match_info in source_matches.items():
-            similarity = match_info.get('similarity', 0)
-            segments_count = match_info.get('segments_count', 0)
-            html_content += f"<li>{source_name}: Similarity {similarity:.2%}, Segments {segments_count}</li>"
-        html_content += "</ul>"
-
-    html_content += """
-    </body>
-    </html>
-    """
+        yield "<h2>Source Matches</h2>"
+        if len(source_matches) > _SOURCE_TABLE_THRESHOLD:
+            yield "<table><tr><th>Source</th><th>Similarity</th><th>Segments</th></tr>"
+            yield from (
+                f"<tr><td>{source_name}</td><td>{match_info.get('similarity', 0) * 100:.2f}%</td>"
+                f"<td>{match_info.get('segments_count', 0)}</td></tr>"
+                for source_name, match_info in source_matches.items()
+            )
+            yield "</table>"
+        else:
+            yield "<ul>"
+            yield from (
+                f"<li>{source_name}: Similarity {match_info.get('similarity', 0) * 100:.2f}%, "
+                f"Segments {match_info.get('segments_count', 0)}</li>"
+                for source_name, match_info in source_matches.items()
+            )
+            yield "</ul>"
 
-    # Write to output file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(html_content)
-
-    return output_file
+    yield _REPORT_FOOTER
@@ -8,13 +8,29 @@ This module provides functions for detecting plagiarism by comparing
 suspicious documents against source documents.
 """
 
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from operator import itemgetter
+
+import numpy as np
+
 from text_processor import (
-    preprocess_text,
-    preprocess_text_with_offsets,
-    generate_ngrams,
-    calculate_similarity
+    Vocab,
+    tokenize_with_offsets,
+    token_ids,
+    ngram_keys,
+    hash_ngrams,
+    fingerprint_similarity
 )
 
+_start_key = itemgetter('suspicious_start_char')
+
+# Upper bound on threads used to prepare source documents; with a single
+# CPU the threads cannot overlap, so sources are prepared serially
+_MAX_WORKERS = min(8, os.cpu_count() or 1)
+
 def find_matching_ngrams(suspicious_tokens, source_tokens, n=3):
     """
     Find matching n-grams between suspicious and source documents.
@@ -27,8 +43,10 @@ def find_matching_ngrams(suspicious_tokens, source_tokens, n=3):
     Returns:
         list: List of dictionaries containing match information
     """
-    suspicious_ngrams = generate_ngrams(suspicious_tokens, n)
-    source_ngrams = generate_ngrams(source_tokens, n)
+    # Byte slices of interned ids hash and compare faster than tuples of strings
+    vocab = Vocab()
+    suspicious_ngrams = ngram_keys(token_ids(suspicious_tokens, vocab), n)
+    source_ngrams = ngram_keys(token_ids(source_tokens, vocab), n)
 
     matches = []  # Stores match information
 
@@ -62,38 +80,146 @@ def find_plagiarism_segments(suspicious_raw_text, source_raw_text, n=4, similari
     Returns:
         tuple: (overall_similarity, plagiarized_segments)
     """
-    suspicious_tokens_info = preprocess_text_with_offsets(suspicious_raw_text)
-    source_tokens_info = preprocess_text_with_offsets(source_raw_text)
+    vocab = Vocab.with_stop_words()
+    suspicious = _prepare_document(suspicious_raw_text, vocab, n)
+    source = _prepare_document(source_raw_text, vocab, n)
 
-    suspicious_words = [token[0] for token in suspicious_tokens_info]
-    source_words = [token[0] for token in source_tokens_info]
+    plagiarized_segments, = _find_segments_in_sources(suspicious_raw_text, suspicious, [source], n)
+    overall_similarity = _similarity(suspicious, source, plagiarized_segments)
 
-    suspicious_ngrams_raw = list(generate_ngrams(suspicious_words, n))
-    source_ngrams_raw = list(generate_ngrams(source_words, n))
+    return overall_similarity, plagiarized_segments
 
-    source_ngram_map = {}
-    for i, s_ngram in enumerate(source_ngrams_raw):
-        source_ngram_map.setdefault(s_ngram, []).append(i)
+def _prepare_document(raw_text, vocab, n):
+    """
+    Tokenize a document once so it can be compared against several others.
 
-    plagiarized_segments = []
+    Args:
+        raw_text (str): Raw text of the document
+        vocab (Vocab): Vocabulary shared by all documents being compared,
+            created with Vocab.with_stop_words()
+        n (int): Size of n-grams
 
-    for i, s_ngram in enumerate(suspicious_ngrams_raw):
-        if s_ngram in source_ngram_map:
-            s_start_token_idx = i
-            s_end_token_idx = i + n - 1
+    Returns:
+        dict: Token start/end offset arrays, int32 token id buffer, distinct
+            token ids and n-gram fingerprints of the document
+    """
+    tokens_info = tokenize_with_offsets(raw_text)
+    ids = token_ids(tokens_info.words, vocab)
+
+    # Stop words own the lowest ids, so one vectorized comparison drops them
+    keep = ids >= vocab.stop_count
+    ids = ids[keep]
+
+    return {
+        'starts': tokens_info.starts[keep],
+        'ends': tokens_info.ends[keep],
+        'id_bytes': ids.tobytes(),
+        'vocabulary': np.unique(ids),
+        'fingerprints': hash_ngrams(ids, n)
+    }
+
+def _prepare_sources(source_texts, vocab, n):
+    """
+    Prepare several source documents concurrently.
+
+    Tokenizing is serialized by the GIL, but id mapping is a short locked
+    step and the hashing and NumPy work release the GIL, so sources overlap.
+
+    Args:
+        source_texts (iterable): Raw source texts
+        vocab (Vocab): Vocabulary shared by all documents being compared
+        n (int): Size of n-grams
+
+    Returns:
+        list: Prepared source documents, in the order of source_texts
+    """
+    source_texts = list(source_texts)
+    if len(source_texts) < 2 or _MAX_WORKERS < 2:
+        return [_prepare_document(source_text, vocab, n) for source_text in source_texts]
+
+    prepare = partial(_prepare_document, vocab=vocab, n=n)
+    with ThreadPoolExecutor(max_workers=min(_MAX_WORKERS, len(source_texts))) as executor:
+        return list(executor.map(prepare, source_texts))
 
-            start_char_suspicious = suspicious_tokens_info[s_start_token_idx][1]
-            end_char_suspicious = suspicious_tokens_info[s_end_token_idx][2]
+def _shares_vocabulary(suspicious, source):
+    # Documents without a single common token cannot share an n-gram
+    return np.isin(source['vocabulary'], suspicious['vocabulary'], assume_unique=True).any()
+
+def _similarity(suspicious, source, segments):
+    # Every shared n-gram yields a segment, so without segments there is no overlap
+    if not segments:
+        return 0.0
+    return fingerprint_similarity(suspicious['fingerprints'], source['fingerprints'])
+
+def _find_segments_in_sources(suspicious_raw_text, suspicious, sources, n):
+    """
+    Find plagiarized segments against all sources in a single pass over the
+    suspicious document's n-grams.
+
+    Args:
+        suspicious_raw_text (str): Raw text from suspicious document
+        suspicious (dict): Suspicious document prepared by _prepare_document
+        sources (list): Source documents prepared by _prepare_document
+        n (int): Size of n-grams
 
-            matched_text = suspicious_raw_text[start_char_suspicious:end_char_suspicious]
+    Returns:
+        list: One list of plagiarized segments per source, in the order of sources
+    """
+    suspicious_fingerprints = suspicious['fingerprints']
+
+    # Vectorized membership prefilter: only n-grams present on both sides are
+    # ever put into or probed against the Python dict below
+    candidates = np.zeros(len(suspicious_fingerprints), dtype=bool)
+
+    # Union of the shared source n-grams: {fingerprint: {source_idx: [token_idx]}}
+    combined_ngram_map = defaultdict(dict)
+    for source_idx, source in enumerate(sources):
+        if not _shares_vocabulary(suspicious, source):
+            continue
+        source_fingerprints = source['fingerprints']
+        candidates |= np.isin(suspicious_fingerprints, source_fingerprints)
+        shared = np.flatnonzero(np.isin(source_fingerprints, suspicious_fingerprints))
+        for i, fingerprint in zip(shared.tolist(), source_fingerprints[shared].tolist()):
+            combined_ngram_map[fingerprint].setdefault(source_idx, []).append(i)
+
+    suspicious_id_bytes = suspicious['id_bytes']
+    # Token id buffers are int32, so an n-gram spans `width` bytes
+    itemsize = np.dtype(np.int32).itemsize
+    width = n * itemsize
+    segments_per_source = [[] for _ in sources]
+
+    candidates = np.flatnonzero(candidates)
+    # Character offsets of every candidate n-gram, gathered in one vectorized step
+    candidate_starts = suspicious['starts'][candidates].tolist()
+    candidate_ends = suspicious['ends'][candidates + (n - 1)].tolist()
+
+    for i, fingerprint, start_char_suspicious, end_char_suspicious in zip(
+        candidates.tolist(), suspicious_fingerprints[candidates].tolist(), candidate_starts, candidate_ends
+    ):
+        s_ngram = suspicious_id_bytes[i * itemsize:i * itemsize + width]
+
+        matched_text = suspicious_raw_text[start_char_suspicious:end_char_suspicious]
+
+        for source_idx, occurrences in combined_ngram_map[fingerprint].items():
+            source = sources[source_idx]
+            source_id_bytes = source['id_bytes']
+            # Report the first confirmed occurrence in each source, so a
+            # fingerprint collision is never reported; later occurrences are
+            # only looked at when an earlier one turns out to be a collision
+            source_start_idx = next(
+                (j for j in occurrences
+                 if source_id_bytes[j * itemsize:j * itemsize + width] == s_ngram),
+                None
+            )
+            if source_start_idx is None:
+                continue
 
-            source_start_idx = source_ngram_map[s_ngram][0]
             source_end_idx = source_start_idx + n - 1
 
-            start_char_source = source_tokens_info[source_start_idx][1]
-            end_char_source = source_tokens_info[source_end_idx][2]
+            start_char_source = source['starts'].item(source_start_idx)
+            end_char_source = source['ends'].item(source_end_idx)
 
-            plagiarized_segments.append({
+            segments_per_source[source_idx].append({
                 'text': matched_text,
                 'suspicious_start_char': start_char_suspicious,
                 'suspicious_end_char': end_char_suspicious,
@@ -101,9 +227,7 @@ def find_plagiarism_segments(suspicious_raw_text, source_raw_text, n=4, similari
                 'source_end_char': end_char_source
             })
 
-    overall_similarity = calculate_similarity(suspicious_words, source_words, n)
-
-    return overall_similarity, plagiarized_segments
+    return segments_per_source
 
 def detect_plagiarism_multiple_sources(suspicious_raw_text, source_documents, n=4, similarity_threshold=0.8):
     """
@@ -122,10 +246,14 @@ def detect_plagiarism_multiple_sources(suspicious_raw_text, source_documents, n=
     source_matches = {}
     max_similarity = 0.0
 
-    for source_name, source_text in source_documents.items():
-        similarity, segments = find_plagiarism_segments(
-            suspicious_raw_text, source_text, n, similarity_threshold
-        )
+    # The suspicious document is tokenized once and scanned once for all sources
+    vocab = Vocab.with_stop_words()
+    suspicious = _prepare_document(suspicious_raw_text, vocab, n)
+    sources = _prepare_sources(source_documents.values(), vocab, n)
+    segments_per_source = _find_segments_in_sources(suspicious_raw_text, suspicious, sources, n)
+
+    for source_name, source, segments in zip(source_documents, sources, segments_per_source):
+        similarity = _similarity(suspicious, source, segments)
         if segments:
             for segment in segments:
                 segment['source_name'] = source_name
@@ -137,18 +265,18 @@ def detect_plagiarism_multiple_sources(suspicious_raw_text, source_documents, n=
         if similarity > max_similarity:
             max_similarity = similarity
 
-    all_plagiarized_segments.sort(key=lambda x: x['suspicious_start_char'])
-
-    merged_segments = merge_overlapping_segments(all_plagiarized_segments)
+    merged_segments = merge_overlapping_segments(all_plagiarized_segments, suspicious_raw_text)
 
     return max_similarity, merged_segments, source_matches
 
-def merge_overlapping_segments(segments):
+def merge_overlapping_segments(segments, suspicious_text=None):
     """
     Merge overlapping plagiarized segments to avoid redundant highlighting.
 
     Args:
-        segments (list): List of plagiarized segments
+        segments (list): List of plagiarized segments, sorted in place
+        suspicious_text (str, optional): Raw suspicious text the segments point
+            into; when given, each merged segment's text is sliced from it once
 
     Returns:
         list: List of merged segments
@@ -156,14 +284,18 @@ def merge_overlapping_segments(segments):
     if not segments:
         return []
 
-    sorted_segments = sorted(segments, key=lambda x: x['suspicious_start_char'])
-    merged = [sorted_segments[0]]
+    segments.sort(key=_start_key)
+    merged = [segments[0]]
+    # Text pieces of each merged segment, joined once at the end
+    text_parts = [[segments[0]['text']]]
 
-    for current in sorted_segments[1:]:
+    for current in segments[1:]:
         previous = merged[-1]
         if current['suspicious_start_char'] <= previous['suspicious_end_char']:
-            previous['suspicious_end_char'] = max(previous['suspicious_end_char'], current['suspicious_end_char'])
-            previous['text'] += current['text'][previous['suspicious_end_char'] - current['suspicious_start_char']:]
+            if current['suspicious_end_char'] > previous['suspicious_end_char']:
+                if suspicious_text is None:
+                    text_parts[-1].append(current['text'][previous['suspicious_end_char'] - current['suspicious_start_char']:])
+                previous['suspicious_end_char'] = current['suspicious_end_char']
             if 'source_name' in current and 'source_name' in previous:
                 if current['source_name'] != previous['source_name']:
                     if 'sources' not in previous:
@@ -172,5 +304,12 @@ def merge_overlapping_segments(segments):
                         previous['sources'].append(current['source_name'])
         else:
             merged.append(current)
+            text_parts.append([current['text']])
+
+    for segment, parts in zip(merged, text_parts):
+        if suspicious_text is not None:
+            segment['text'] = suspicious_text[segment['suspicious_start_char']:segment['suspicious_end_char']]
+        elif len(parts) > 1:
+            segment['text'] = ''.join(parts)
 
     return merged
@@ -9,69 +9,171 @@ and similarity calculation.
 """
 
 import re
-import string
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from nltk.util import ngrams
+import sys
+import threading
+from array import array
+from dataclasses import dataclass
+from functools import lru_cache
+import numpy as np
 
-# Download NLTK data (uncomment these lines for first-time use)
-# nltk.download('punkt')
-# nltk.download('stopwords')
+try:
+    from numba import njit
+except ImportError:  # Numba is optional; hash_ngrams falls back to NumPy
+    njit = None
+
+# Runs of letters/digits; punctuation (including '_') acts as a separator
+_WORD_RE = re.compile(r'[^\W_]+')
+
+# Rabin-Karp base for n-gram fingerprints; arithmetic wraps modulo 2**64.
+# The base must be large compared with the values it multiplies: with a base
+# smaller than the vocabulary (e.g. 257), (a, b, c, d) and (a, b, c + 1, d - 257)
+# share a fingerprint. fingerprint_similarity counts fingerprints without
+# confirming them, so such collisions would inflate similarity scores.
+_HASH_BASE = 0x9E3779B97F4A7C15
+
+# SplitMix64 constants used to scramble token ids before they are hashed
+_MIX_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_MIX_MUL1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_MUL2 = np.uint64(0x94D049BB133111EB)
+
+# Tokens hashed by warm_up(); any length that reaches the hashing loop will do
+_HASH_WARM_UP_TOKENS = 2
+
+@lru_cache(maxsize=1)
+def _stopwords():
+    # Loaded from the NLTK corpus once, on first use rather than at import.
+    # NLTK is only needed for this list, and importing it takes ~250 ms.
+    import nltk
+    from nltk.corpus import stopwords
+
+    try:
+        return frozenset(stopwords.words('english'))
+    except LookupError:
+        # First run on this machine: fetch the corpus once, then retry
+        nltk.download('stopwords', quiet=True)
+        return frozenset(stopwords.words('english'))
+
+def warm_up():
+    """
+    Load the stop word corpus and compile the n-gram hashing loop ahead of
+    time, so the first document processed is as fast as later ones.
+
+    Call once at process start; e.g. under gunicorn's preload_app the work
+    is done in the master and inherited by every forked worker.
+    """
+    _stopwords()
+    hash_ngrams(np.zeros(_HASH_WARM_UP_TOKENS, dtype=np.int32), _HASH_WARM_UP_TOKENS)
 
 def preprocess_text(text):
     """
     Preprocess text by converting to lowercase, removing punctuation,
     tokenizing, and removing stopwords.
 
+    Results are cached per text, so resubmitting the same document skips
+    tokenizing it again.
+
     Args:
         text (str): Raw text string
 
     Returns:
         list: List of filtered tokens
     """
-    text = text.lower()
-    # Remove punctuation
-    text = text.translate(str.maketrans('', '', string.punctuation))
-    tokens = word_tokenize(text)
-    stop_words = set(stopwords.words('english'))
-    filtered_tokens = [word for word in tokens if word not in stop_words]
-    return filtered_tokens
+    return list(_preprocess_cached(text))
+
+@lru_cache(maxsize=256)
+def _preprocess_cached(text):
+    stop_words = _stopwords()
+    # Interned tokens are shared between cached documents, and hashing them
+    # in sets and dicts reuses the cached hash and compares by identity first
+    return tuple(sys.intern(word) for word in _WORD_RE.findall(text.lower()) if word not in stop_words)
+
+def preprocess_batch(texts):
+    """
+    Preprocess several texts in one call, e.g. every source document of a
+    request.
+
+    Args:
+        texts (iterable): Raw text strings
+
+    Returns:
+        list: One list of filtered tokens per text, in input order
+    """
+    preprocess = _preprocess_cached
+    return [list(preprocess(text)) for text in texts]
 
 def preprocess_text_with_offsets(text):
     """
     Preprocess text while preserving character offsets for highlighting.
 
+    Results are cached per text, like preprocess_text.
+
     Args:
         text (str): Raw text string
 
     Returns:
         list: List of tuples (token, start_char, end_char)
     """
-    clean_text = text.lower()
-    # Replace punctuation with spaces to avoid merging words
-    clean_text = re.sub(f'[{re.escape(string.punctuation)}]', ' ', clean_text)
+    return list(_preprocess_with_offsets_cached(text))
+
+@lru_cache(maxsize=256)
+def _preprocess_with_offsets_cached(text):
+    stop_words = _stopwords()
+    tokens_info = tokenize_with_offsets(text)
+    # Filter stop words here if desired, but keep original offsets for highlighting
+    return tuple(
+        token for token in zip(tokens_info.words, tokens_info.starts.tolist(), tokens_info.ends.tolist())
+        if token[0] not in stop_words
+    )
+
+@dataclass(frozen=True)
+class TokensInfo:
+    """
+    Tokens of a text with their character offsets, stored as parallel arrays.
 
-    tokens_with_offsets = []
-    words = re.finditer(r'\b\w+\b', clean_text)  # Find word boundaries
+    Attributes:
+        words (tuple): Lowercased tokens
+        starts (numpy.ndarray): Read-only int32 start offset of each token
+        ends (numpy.ndarray): Read-only int32 end offset of each token
+    """
+    words: tuple
+    starts: np.ndarray
+    ends: np.ndarray
 
-    stop_words = set(stopwords.words('english'))
+@lru_cache(maxsize=128)
+def tokenize_with_offsets(text):
+    """
+    Tokenize text with character offsets, keeping stop words.
 
-    for match in words:
-        word = match.group(0)
-        start_char = match.start()
-        end_char = match.end()
+    Results are cached per text, so a document checked repeatedly (e.g. the
+    same source corpus across requests) is only tokenized once.
 
-        # Filter stop words here if desired, but keep original offsets for highlighting
-        if word not in stop_words:
-            tokens_with_offsets.append((word, start_char, end_char))
+    Args:
+        text (str): Raw text string
 
-    return tokens_with_offsets
+    Returns:
+        TokensInfo: Every word of the text with its offsets
+    """
+    words = []
+    offsets = array('i')
+    intern = sys.intern
+    # Match on the raw text and lowercase per word: str.lower() can change the
+    # length of some characters (e.g. 'İ'), which would shift every later offset
+    for match in _WORD_RE.finditer(text):
+        words.append(intern(match.group(0).lower()))
+        offsets.extend(match.span())
+
+    spans = np.array(offsets, dtype=np.int32).reshape(-1, 2)
+    # The result is cached and shared between callers, so its arrays are read-only
+    spans.flags.writeable = False
+    return TokensInfo(tuple(words), spans[:, 0], spans[:, 1])
 
 def generate_ngrams(tokens, n=3):
     """
     Generate n-grams from a list of tokens.
 
+    Results are cached per (tokens, n), so a document n-grammed repeatedly
+    only builds its tuples once.
+
     Args:
         tokens (list): List of tokens
         n (int): Size of n-grams
@@ -79,7 +181,162 @@ def generate_ngrams(tokens, n=3):
     Returns:
         list: List of n-grams
     """
-    return list(ngrams(tokens, n))
+    return list(_ngrams_cached(tuple(tokens), n))
+
+@lru_cache(maxsize=64)
+def _ngrams_cached(tokens, n):
+    if n < 1:
+        return ()
+    # Zipping n shifted slices builds each tuple directly, without the
+    # tee/deque machinery behind nltk.util.ngrams
+    return tuple(zip(*(tokens[i:] for i in range(n))))
+
+class Vocab:
+    """
+    Token vocabulary shared by every document in one comparison, so that
+    equal tokens map to equal small integer ids.
+
+    get_id is not synchronized; use token_ids when several threads share
+    one vocabulary.
+
+    Args:
+        stop_words (iterable, optional): Tokens that receive the lowest ids,
+            [0, stop_count), so they can be filtered out by id alone
+    """
+
+    def __init__(self, stop_words=()):
+        self._ids = {word: i for i, word in enumerate(stop_words)}
+        self.stop_count = len(self._ids)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def with_stop_words(cls):
+        """
+        Create a vocabulary whose lowest ids are the English stop words.
+
+        Returns:
+            Vocab: Vocabulary with stop_count set to the number of stop words
+        """
+        return cls(sorted(_stopwords()))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get_id(self, token):
+        """
+        Return the id of a token, assigning the next free id to unseen tokens.
+
+        Args:
+            token (str): Token to look up
+
+        Returns:
+            int: Token id
+        """
+        return self._ids.setdefault(token, len(self._ids))
+
+def token_ids(tokens, vocab):
+    """
+    Map tokens to integer ids, assigning new ids as unseen tokens appear.
+
+    Args:
+        tokens (list): List of tokens
+        vocab (Vocab): Vocabulary shared by every document that should be
+            compared against the others
+
+    Returns:
+        numpy.ndarray: int32 array of token ids
+    """
+    # A whole document is mapped under the lock, so concurrent callers never
+    # hand out the same id to two different tokens
+    with vocab._lock:
+        return np.fromiter(map(vocab.get_id, tokens), dtype=np.int32, count=len(tokens))
+
+def ngram_keys(ids, n=3):
+    """
+    Generate exact n-gram keys as slices of one contiguous token id buffer.
+
+    Unlike fingerprints the keys cannot collide, and unlike tuples no
+    per-n-gram container of token objects is built.
+
+    Args:
+        ids (list or numpy.ndarray): Integer token ids
+        n (int): Size of n-grams
+
+    Returns:
+        generator: One bytes key per n-gram, in document order
+    """
+    if n < 1:
+        return iter(())
+
+    ids = np.asarray(ids, dtype=np.int32)
+    buffer = ids.tobytes()
+    width = n * ids.itemsize
+    return (buffer[start:start + width] for start in range(0, len(buffer) - width + 1, ids.itemsize))
+
+def hash_ngrams(ids, n=3):
+    """
+    Compute rolling Rabin-Karp fingerprints for the n-grams of a token id array.
+
+    Ids are scrambled before hashing, so n-grams of related ids do not
+    collide the way they would with raw ids and a small base.
+
+    Args:
+        ids (list or numpy.ndarray): Integer token ids
+        n (int): Size of n-grams
+
+    Returns:
+        numpy.ndarray: uint64 array with one fingerprint per n-gram, in document order
+    """
+    ids = np.asarray(ids, dtype=np.int32)
+    if n < 1 or len(ids) < n:
+        return np.empty(0, dtype=np.uint64)
+
+    mixed = _mix_ids(ids)
+    if njit is None:
+        return _rolling_hashes_numpy(mixed, n)
+    return _rolling_hashes_jit(mixed, n, np.uint64(_HASH_BASE), _high_power(n))
+
+def _mix_ids(ids):
+    # SplitMix64 finalizer: spreads small, consecutive ids over all 64 bits so
+    # that no linear relation between ids carries over into the fingerprints
+    mixed = ids.astype(np.uint64) + _MIX_GAMMA
+    mixed ^= mixed >> np.uint64(30)
+    mixed *= _MIX_MUL1
+    mixed ^= mixed >> np.uint64(27)
+    mixed *= _MIX_MUL2
+    mixed ^= mixed >> np.uint64(31)
+    return mixed
+
+@lru_cache(maxsize=None)
+def _high_power(n):
+    # Weight of the token leaving the window: base ** (n - 1) modulo 2**64
+    return np.uint64(pow(_HASH_BASE, n - 1, 1 << 64))
+
+def _rolling_hashes_numpy(ids, n):
+    # Same fingerprints as the rolling recurrence, built from n shifted views
+    count = len(ids) - n + 1
+    base = np.uint64(_HASH_BASE)
+    fingerprints = np.zeros(count, dtype=np.uint64)
+    for offset in range(n):
+        fingerprints = fingerprints * base + ids[offset:offset + count]
+    return fingerprints
+
+if njit is not None:
+    @njit(cache=True, nogil=True)
+    def _rolling_hashes_jit(ids, n, base, high_power):
+        # ids are already mixed by _mix_ids; the fingerprints must match
+        # _rolling_hashes_numpy exactly, as both feed the unconfirmed
+        # similarity count
+        fingerprints = np.empty(ids.shape[0] - n + 1, dtype=np.uint64)
+        fingerprint = np.uint64(0)
+        for i in range(n):
+            fingerprint = fingerprint * base + ids[i]
+        fingerprints[0] = fingerprint
+
+        for i in range(n, ids.shape[0]):
+            fingerprint = (fingerprint - ids[i - n] * high_power) * base + ids[i]
+            fingerprints[i - n + 1] = fingerprint
+        return fingerprints
 
 def calculate_similarity(suspicious_tokens, source_tokens, n=3):
     """
@@ -93,13 +350,43 @@ def calculate_similarity(suspicious_tokens, source_tokens, n=3):
     Returns:
         float: Similarity score (0-1)
     """
-    suspicious_ngrams = set(generate_ngrams(suspicious_tokens, n))
-    source_ngrams = set(generate_ngrams(source_tokens, n))
+    # Either side without a single n-gram cannot overlap with the other
+    if len(suspicious_tokens) < n or len(source_tokens) < n:
+        return 0.0
+
+    vocab = Vocab()
+    suspicious_ngrams = hash_ngrams(token_ids(suspicious_tokens, vocab), n)
+    source_ngrams = hash_ngrams(token_ids(source_tokens, vocab), n)
+
+    return fingerprint_similarity(suspicious_ngrams, source_ngrams)
+
+def fingerprint_similarity(suspicious_fingerprints, source_fingerprints):
+    """
+    Calculate the share of suspicious n-gram fingerprints found in the source.
+
+    Args:
+        suspicious_fingerprints (numpy.ndarray): N-gram fingerprints of suspicious document
+        source_fingerprints (numpy.ndarray): N-gram fingerprints of source document
+
+    Returns:
+        float: Similarity score (0-1)
+    """
+    if not len(suspicious_fingerprints) or not len(source_fingerprints):
+        return 0.0  # Avoid division by zero; nothing can match an empty source
 
-    if not suspicious_ngrams:
-        return 0.0  # Avoid division by zero
+    # Sorted unique arrays keep the intersection inside NumPy
+    suspicious_ngrams = np.unique(np.asarray(suspicious_fingerprints, dtype=np.uint64))
+    source_ngrams = np.unique(np.asarray(source_fingerprints, dtype=np.uint64))
 
-    common_ngrams = suspicious_ngrams.intersection(source_ngrams)
-    similarity_score = len(common_ngrams) / len(suspicious_ngrams)
+    # Count the overlap by binary-searching the smaller array in the larger one,
+    # instead of materializing the intersection only to take its size
+    if suspicious_ngrams.size <= source_ngrams.size:
+        small, large = suspicious_ngrams, source_ngrams
+    else:
+        small, large = source_ngrams, suspicious_ngrams
+    positions = np.searchsorted(large, small)
+    positions[positions == large.size] = 0
+    common_count = int(np.count_nonzero(large[positions] == small))
+    similarity_score = common_count / suspicious_ngrams.size
 
     return similarity_score